@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import argparse
+import subprocess
+from statistics import median
+
+APP_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# the scripts bin/ and cron start over and over
+ENTRY_POINTS = [
+  'read_meter_images',
+  'process_series',
+  'decode_metar_weather_data',
+  'fetch_thermostat_data',
+  'graph_rates',
+  'graph_hourlies',
+  'rollup_usage',
+  'shard_readings',
+]
+
+def cold_start(module, runs):
+  '''
+    wall time of a fresh interpreter importing module, measured runs times
+  '''
+  times = []
+  for i in range(runs):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import ' + module], cwd=APP_PATH, check=True)
+    times.append(time.perf_counter() - start)
+  return times
+
+def heaviest_imports(module, count=5):
+  '''
+    the top-level packages that contribute most to importing module, from python -X importtime
+  '''
+  proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+    cwd=APP_PATH, check=True, stderr=subprocess.PIPE, universal_newlines=True)
+  packages = {}
+  for line in proc.stderr.splitlines():
+    # import time: self [us] | cumulative | imported package
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, name = line[len('import time:'):].split('|')
+    # nesting is shown as two spaces per level; only direct imports of the entry point matter
+    level = (len(name) - len(name.lstrip()) - 1) // 2
+    if level == 1:
+      packages[name.strip()] = int(cumulative) / 1e6
+  return sorted(packages.items(), key=lambda kv: -kv[1])[:count]
+
+def baseline():
+  return median(cold_start('sys', 5))
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'Measure cold-start import time of each metermaid entry point'
+  )
+  parser.add_argument('module', nargs='*', default=ENTRY_POINTS)
+  parser.add_argument('-n', '--runs', type=int, default=5)
+  parser.add_argument('--budget', type=float, help='exit 1 if any median cold start (seconds) exceeds this')
+  parser.add_argument('-v', '--verbose', action='store_true', help='list the heaviest imports of each entry point')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args()
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+
+  interpreter = baseline()
+  print('{:<28} {:>10} {:>10} {:>10}'.format('entry point', 'min (s)', 'median (s)', 'imports (s)'))
+  print('{:<28} {:>10} {:>10.3f} {:>10}'.format('(bare interpreter)', '', interpreter, ''))
+
+  over_budget = []
+  for module in args.module:
+    times = cold_start(module, args.runs)
+    print('{:<28} {:>10.3f} {:>10.3f} {:>10.3f}'.format(module, min(times), median(times), median(times) - interpreter))
+    if args.verbose:
+      for name, seconds in heaviest_imports(module):
+        print('    {:<24} {:>10.3f}'.format(name, seconds))
+    if args.budget is not None and median(times) > args.budget:
+      over_budget.append(module)
+
+  if over_budget:
+    printerr('over the {}s budget: {}'.format(args.budget, ', '.join(over_budget)))
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import record_io
+
+def synthetic_rates(count, seed=0):
+  '''
+    records shaped like process_series.py output
+  '''
+  rng = random.Random(seed)
+  timestamp = 1672549200.0
+  reading = 573200.0
+  for i in range(count):
+    delta_time = rng.choice([10.0, 10.0, 10.0, 20.0, 60.0])
+    delta = rng.uniform(0.001, 0.6)
+    timestamp += delta_time
+    reading += delta
+    yield {
+      'reading': reading,
+      'val': rng.uniform(0, 2),
+      'delta': delta,
+      'delta_time': delta_time,
+      'delta_reading': delta,
+      'rate': delta / delta_time,
+      'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+      'hour': time.strftime('%Y-%m-%dT%H%Z', time.localtime(timestamp)),
+      'timestamp': timestamp,
+    }
+
+def best_of(runs, fn):
+  times = []
+  for i in range(runs):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+# the per-record path every stage used before record_io
+def current_decode(path, fields):
+  with open(path) as f:
+    for line in f:
+      record = json.loads(line)
+
+def current_encode(records, out):
+  for record in records:
+    print(json.dumps(record), file=out)
+  out.flush()
+
+def current_columns(path, fields):
+  columns = dict((key, []) for key in fields)
+  with open(path) as f:
+    for line in f:
+      record = json.loads(line)
+      for key, column in columns.items():
+        column.append(record.get(key))
+
+def batched_decode(path, fields):
+  with open(path, 'rb') as f:
+    for record in record_io.read_records(f):
+      pass
+
+def batched_encode(records, out):
+  with record_io.RecordWriter(out) as writer:
+    for record in records:
+      writer.write(record)
+
+def batched_columns(path, fields):
+  with open(path, 'rb') as f:
+    record_io.read_columns(f, fields)
+
+def installed_backends():
+  installed = []
+  for name in record_io.BACKENDS:
+    try:
+      record_io.use_backend(name)
+      installed.append(name)
+    except Exception as e:
+      debug(e)
+  return installed
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'Compare per-line json with record_io batched reads/writes on each installed json backend'
+  )
+  parser.add_argument('filename', nargs='?', help='ndjson file to benchmark on (default: synthetic process_series.py rates)')
+  parser.add_argument('-n', '--count', type=int, default=200000, help='synthetic records to generate')
+  parser.add_argument('--runs', type=int, default=3, help='each path is timed this many times; the best run is reported')
+  parser.add_argument('--fields', default='timestamp,rate', help='comma separated fields for the column loader')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args()
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+
+  tmp = None
+  if args.filename:
+    if not os.path.exists(args.filename):
+      printerr('could not find file: {}'.format(args.filename))
+      printerr()
+      printerr(parser.format_help())
+      sys.exit(1)
+    path = args.filename
+  else:
+    tmp = tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False)
+    with tmp:
+      for record in synthetic_rates(args.count):
+        tmp.write(json.dumps(record) + '\n')
+    path = tmp.name
+
+  try:
+    with open(path) as f:
+      records = [json.loads(line) for line in f if not line.isspace()]
+    fields = args.fields.split(',')
+    out = open(os.devnull, 'w')
+    print('{} records, {:.1f} MB'.format(len(records), os.path.getsize(path) / 1e6))
+
+    paths = [
+      ('decode', current_decode, batched_decode, lambda fn: fn(path, fields)),
+      ('encode', current_encode, batched_encode, lambda fn: fn(records, out)),
+      ('columns', current_columns, batched_columns, lambda fn: fn(path, fields)),
+    ]
+    backends = installed_backends()
+    print('{:<10} {:<22} {:>10} {:>14} {:>9}'.format('path', 'implementation', 'best (s)', 'records/s', 'speedup'))
+    for name, current, batched, call in paths:
+      baseline = best_of(args.runs, lambda: call(current))
+      print('{:<10} {:<22} {:>10.3f} {:>14,.0f} {:>9}'.format(name, 'per line (json)', baseline, len(records) / baseline, '1.00x'))
+      for backend in backends:
+        record_io.use_backend(backend)
+        seconds = best_of(args.runs, lambda: call(batched))
+        print('{:<10} {:<22} {:>10.3f} {:>14,.0f} {:>8.2f}x'.format(name, 'record_io (' + backend + ')', seconds, len(records) / seconds, baseline / seconds))
+  finally:
+    if tmp is not None:
+      os.remove(tmp.name)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
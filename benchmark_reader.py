@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from statistics import median
+import cv2
+import read_meter_images as reader
+import generate_meter_images as generator
+
+# a reading within this many cf of the truth counts as correct. the precise dial turns once
+# per 1000 cf, so one degree of needle error is ~2.8 cf; a misread whole digit on any of the
+# other dials is off by at least 1000.
+TOLERANCE = 25
+
+def time_stage(name, inputs, fn, results):
+  '''
+    run fn over every input, record frames/second for the stage and return the outputs
+  '''
+  start = time.perf_counter()
+  outputs = [fn(i) for i in inputs]
+  elapsed = time.perf_counter() - start
+  results[name] = {'frames': len(inputs), 'seconds': elapsed, 'fps': len(inputs) / elapsed if elapsed else None}
+  return outputs
+
+def benchmark_stages(filenames):
+  results = {}
+  originals = time_stage('imread', filenames, cv2.imread, results)
+  unskewed = time_stage('unskew_dials', originals, reader.unskew_dials, results)
+  contours = time_stage('find_contours', unskewed, reader.find_contours, results)
+  # analyze_contour draws on the image it is given, so hand it copies made outside the timing
+  annotated = [u.copy() for u in unskewed]
+  dials = time_stage('analyze_contours', list(zip(contours, annotated, filenames)),
+    lambda args: reader.analyze_contours(*args), results)
+  time_stage('calculate_total', dials, reader.calculate_total, results)
+
+  readings = time_stage('end_to_end', filenames, lambda f: reader.analyze_raw(open(f), 'noop'), results)
+  return results, readings
+
+def score(readings, truths, tolerance=TOLERANCE):
+  truth_by_src = dict((t['imagesrc'], t) for t in truths)
+  errors = []
+  test_errors = []
+  for r in readings:
+    truth = truth_by_src[r['imagesrc']]
+    errors.append(abs(r['reading'] - truth['reading']))
+    # test dial keys are floats in memory and strings once they have been through json
+    read_test = dict((str(factor), value) for factor, value in r['test'].items())
+    for factor in truth['test']:
+      if str(factor) in read_test:
+        # a test dial shows the reading modulo one revolution (10 * factor cf). the expected value
+        # comes from the true reading rather than the generator's dial math, so a generator that
+        # turns the dials at the wrong speed is caught here. compare around the circle.
+        period = 10 * float(factor)
+        diff = abs(read_test[str(factor)] - truth['reading']) % period
+        test_errors.append(min(diff, period - diff))
+  return {
+    'frames': len(readings),
+    'correct': sum(1 for e in errors if e <= tolerance),
+    'accuracy': sum(1 for e in errors if e <= tolerance) / len(errors) if errors else None,
+    'median_error': median(errors) if errors else None,
+    'median_test_error': median(test_errors) if test_errors else None,
+    'test_dials_read': len(test_errors),
+  }
+
+def print_report(results, accuracy, tolerance=TOLERANCE, file=sys.stdout):
+  print('{:<20} {:>8} {:>10} {:>12}'.format('stage', 'frames', 'seconds', 'frames/sec'), file=file)
+  for name, r in results.items():
+    print('{:<20} {:>8} {:>10.3f} {:>12.1f}'.format(name, r['frames'], r['seconds'], r['fps'] or 0), file=file)
+  print(file=file)
+  print('readings within {} cf of truth: {}/{} ({:.1%})'.format(
+    tolerance, accuracy['correct'], accuracy['frames'], accuracy['accuracy'] or 0), file=file)
+  print('median reading error: {} cf'.format(accuracy['median_error']), file=file)
+  print('median test dial error: {} cf over {} dials read'.format(accuracy['median_test_error'], accuracy['test_dials_read']), file=file)
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'Measure meter reader throughput per stage and accuracy on synthetic frames'
+  )
+  parser.add_argument('-n', '--count', type=int, default=200)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--skew', type=float, default=0.04)
+  parser.add_argument('--rotation', type=float, default=4)
+  parser.add_argument('--noise', type=float, default=2.0)
+  parser.add_argument('--lighting', type=float, default=0.15)
+  parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='cf a reading may be off by and still count as correct')
+  parser.add_argument('--keep', help='write the frames here and keep them instead of using a temporary directory')
+  parser.add_argument('--json', action='store_true', help='print the results as json')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args()
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+    reader.DEBUG = True
+
+  outdir = args.keep or tempfile.mkdtemp(prefix='metermaid-bench-')
+  try:
+    truths = list(generator.generate(outdir, args.count, args.seed,
+      skew=args.skew, rotation=args.rotation, noise=args.noise, lighting=args.lighting))
+    results, readings = benchmark_stages([t['imagesrc'] for t in truths])
+    accuracy = score(readings, truths, args.tolerance)
+  finally:
+    if not args.keep:
+      shutil.rmtree(outdir)
+
+  if args.json:
+    print(json.dumps({'stages': results, 'accuracy': accuracy}))
+  else:
+    print_report(results, accuracy, args.tolerance)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
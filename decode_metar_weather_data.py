@@ -2,17 +2,17 @@
 
 import sys
 import os
-import json
 import math
 from datetime import datetime
 import pytz
 from metar import Metar
 import argparse
-
-
-import matplotlib.pyplot as plt
+import render_cache
+import record_io
 
 def zoom_factory(ax,base_scale = 2.):
+  import matplotlib.pyplot as plt
+
   def zoom_fun(event):
     cur_xlim = ax.get_xlim()
     xdata = event.xdata
@@ -35,9 +35,11 @@ def process_file(file, options={}):
   rate_vals = []
   previous_time = None
   previous_hour_temp = None
+  writer = record_io.RecordWriter(sys.stdout)
 
-  for line in file:
-    weather_entry = json.loads(line)
+  # only FM-15 (routine METAR) reports are used, so the other report types are skipped
+  # before they are decoded
+  for weather_entry in record_io.read_records(file, contains='FM-15'):
     if weather_entry['REPORT_TYPE'] == 'FM-15' and 'REM' in weather_entry:
       rem = weather_entry['REM']
       debug()
@@ -64,7 +66,7 @@ def process_file(file, options={}):
 
         if options.get('action') == 'ndjson':
           try:
-            print(json.dumps({
+            writer.write({
               'utcdatetime': weather_entry['DATE'],
               'hour': datetime.strftime(date, '%Y-%m-%dT%H%Z'),
               'temp': None if metar_object.temp is None else metar_object.temp.value("F"),
@@ -73,7 +75,7 @@ def process_file(file, options={}):
               # 'weather': metar_object.weather,
               'wind_speed': None if metar_object.wind_speed is None else metar_object.wind_speed.value("MPH"),
               'wind_gust': None if metar_object.wind_gust is None else metar_object.wind_speed.value("MPH")
-            }))
+            })
           except Exception as e:
             printerr(e)
         else:
@@ -81,15 +83,16 @@ def process_file(file, options={}):
           rate_times.append(date)
 
       previous_hour_temp = metar_object.temp
+  writer.flush()
   if options.get('action') == 'graph':
+    # only the graph action needs pyplot, which is slow to import
+    import matplotlib.pyplot as plt
     plt.plot(rate_times, rate_vals, ds="steps-pre")
     ax = plt.gca()
 
     scale = 1.5
     f = zoom_factory(ax,base_scale = scale)
 
-    plt.show()
-
 DEBUG = False
 
 def debug(*args, **kwargs):
@@ -107,13 +110,16 @@ def main(argv):
   parser.add_argument('action', choices=['ndjson', 'graph', 'debug'])
   parser.add_argument('filename', nargs='+') # positional argument
   parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+  render_cache.add_render_arguments(parser)
 
   args = parser.parse_args()
+  if args.output and args.action != 'graph':
+    parser.error('--output only applies to the graph action')
 
   global DEBUG
   if args.debug:
     DEBUG = True
-    # pass
+    render_cache.DEBUG = True
 
   for filename in args.filename:
     if not os.path.exists(filename):
@@ -121,7 +127,17 @@ def main(argv):
       printerr()
       printerr(parser.format_help())
       sys.exit(1)
+
+  if args.output:
+    render_cache.render(args.output, args.filename, vars(args),
+      lambda: [process_file(open(filename), vars(args)) for filename in args.filename], __file__)
+    return
+
+  for filename in args.filename:
     process_file(open(filename), vars(args))
+    if args.action == 'graph':
+      import matplotlib.pyplot as plt
+      plt.show()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import matplotlib.dates as mdates
+
+# each pyramid level merges this many buckets of the level below it
+LEVEL_FACTOR = 2
+
+# points kept per horizontal pixel of the axes (one min and one max per bucket)
+POINTS_PER_PIXEL = 2
+
+def to_num(times):
+  '''
+    convert a list of datetimes (or numbers) into a float array matplotlib can plot directly
+  '''
+  if len(times) and not isinstance(times[0], (int, float, np.number)):
+    return np.asarray(mdates.date2num(times), dtype=np.float64)
+  return np.asarray(times, dtype=np.float64)
+
+class SeriesPyramid:
+  '''
+    multi-resolution min/max pyramid over a time series sorted by x.
+
+    level 0 is the raw series; each level above stores, for every bucket, the x/y of its
+    minimum and maximum sample. level k buckets cover LEVEL_FACTOR**k raw samples.
+  '''
+  def __init__(self, x, y):
+    x = to_num(x)
+    y = np.asarray(y, dtype=np.float64)
+    order = np.argsort(x, kind='stable')
+    self.x = x[order]
+    self.y = y[order]
+    self.levels = [self._raw_level()]
+    while len(self.levels[-1]['start']) > 1:
+      self.levels.append(self._merge(self.levels[-1]))
+
+  def _raw_level(self):
+    return {
+      'start': self.x,
+      'lo_x': self.x, 'lo_y': self.y,
+      'hi_x': self.x, 'hi_y': self.y,
+    }
+
+  @staticmethod
+  def _merge(level):
+    n = len(level['start'])
+    pad = (-n) % LEVEL_FACTOR
+    def grouped(a):
+      if pad:
+        a = np.concatenate([a, np.repeat(a[-1:], pad)])
+      return a.reshape(-1, LEVEL_FACTOR)
+    lo_y, lo_x = grouped(level['lo_y']), grouped(level['lo_x'])
+    hi_y, hi_x = grouped(level['hi_y']), grouped(level['hi_x'])
+    rows = np.arange(lo_y.shape[0])
+    lo_pick = np.argmin(lo_y, axis=1)
+    hi_pick = np.argmax(hi_y, axis=1)
+    return {
+      'start': grouped(level['start'])[:, 0],
+      'lo_x': lo_x[rows, lo_pick], 'lo_y': lo_y[rows, lo_pick],
+      'hi_x': hi_x[rows, hi_pick], 'hi_y': hi_y[rows, hi_pick],
+    }
+
+  def query(self, xmin, xmax, max_points):
+    '''
+      return the x/y to draw for the window [xmin, xmax] using the finest level that keeps
+      the point count at or under max_points. one bucket either side of the window is
+      included so lines run off the edge of the axes instead of stopping short.
+    '''
+    if len(self.x) == 0:
+      return self.x, self.y
+    for level in self.levels:
+      start = level['start']
+      first = max(0, np.searchsorted(start, xmin, side='right') - 2)
+      last = min(len(start), np.searchsorted(start, xmax, side='left') + 1)
+      if level is self.levels[-1] or 2 * (last - first) <= max_points:
+        break
+    if level is self.levels[0]:
+      return self.x[first:last], self.y[first:last]
+    xs = np.concatenate([level['lo_x'][first:last], level['hi_x'][first:last]])
+    ys = np.concatenate([level['lo_y'][first:last], level['hi_y'][first:last]])
+    order = np.argsort(xs, kind='stable')
+    return xs[order], ys[order]
+
+def axes_max_points(ax):
+  return max(2, int(ax.get_window_extent().width * POINTS_PER_PIXEL))
+
+def plot_lod(ax, x, y, **kwargs):
+  '''
+    plot a series through a SeriesPyramid; the drawn data is re-queried whenever the x
+    limits change (scroll zoom, toolbar pan/zoom) so only about one point per pixel is drawn.
+  '''
+  pyramid = SeriesPyramid(x, y)
+  if len(x) and not isinstance(x[0], (int, float, np.number)):
+    ax.xaxis_date()
+  window = (pyramid.x[0], pyramid.x[-1]) if len(pyramid.x) else ax.get_xlim()
+  line, = ax.plot(*pyramid.query(*window, axes_max_points(ax)), **kwargs)
+  if len(pyramid.x):
+    # the coarse first draw may not include the end points; make sure autoscale covers them
+    ax.update_datalim(np.column_stack([window, [pyramid.y.min(), pyramid.y.max()]]))
+    ax.autoscale_view()
+
+  def requery(ax):
+    line.set_data(*pyramid.query(*ax.get_xlim(), axes_max_points(ax)))
+
+  ax.callbacks.connect('xlim_changed', requery)
+  line.pyramid = pyramid
+  return line
@@ -6,12 +6,13 @@ import json
 import argparse
 import datetime
 import requests
+import record_io
 
 def fetch_thermostat_data(project_id, token):
   api_url = 'https://smartdevicemanagement.googleapis.com/v1/enterprises/%s/devices' % project_id
 
   response = requests.get(api_url, headers={'Authorization': 'Bearer %s' % token})
-  return json.loads(response.text)
+  return record_io.loads(response.content)
 
 def update_bearer_token(state, statefile):
   api_url = ('https://www.googleapis.com/oauth2/v4/token?' +
@@ -54,7 +55,7 @@ def process_file(file, options={}):
 
   response = fetch_thermostat_data(state['project_id'], token)
   output = {'timestamp': datetime.datetime.now().timestamp(), 'response_body': response}
-  print(json.dumps(output))
+  print(record_io.dumps(output))
 
 DEBUG = False
 
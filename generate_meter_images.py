@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import record_io
+import argparse
+import numpy as np
+import cv2
+from math import cos, sin, pi
+from datetime import datetime, timedelta
+from read_meter_images import DIALS, PROJECTED_WIDTH, PROJECTED_HEIGHT
+from process_series import MAX_JITTER
+
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+# needle geometry in projected (unskewed) pixels
+NEEDLE_LENGTH = 27
+NEEDLE_WIDTH = 14
+HUB_RADIUS = 7
+DIAL_RADIUS = 34
+
+# most cf used between two frames. process_series takes a test dial moving more than MAX_JITTER
+# of a revolution for a wrap the other way, so this keeps the 0.5 cf dial unambiguous
+MAX_USAGE = MAX_JITTER * min(10 * spec['factor'] for spec in DIALS if spec.get('test'))
+
+def dial_values(reading):
+  '''
+    the value (0-10) each dial in DIALS shows for a meter reading in cf. every dial turns
+    continuously, so e.g. the 1000s dial is at 2.5 for a reading of 2500 and the 2 cf test dial
+    (factor 0.2) moves 5 digits per cf.
+  '''
+  return [(reading / spec['factor']) % 10 for spec in DIALS]
+
+def needle_angle(spec, value):
+  # inverse of read_meter_images.get_dial_value, in radians, image coordinates (y down)
+  turns = value if spec['clockwise'] else 10 - value
+  return (turns * 36 - 90) * pi / 180
+
+def draw_panel(values):
+  '''
+    the dial panel as read_meter_images sees it after unskewing: white, with a ring, ticks and
+    a needle per dial
+  '''
+  panel = np.full((PROJECTED_HEIGHT, PROJECTED_WIDTH, 3), 255, np.uint8)
+  for spec, value in zip(DIALS, values):
+    cx, cy = spec['center']
+    cv2.circle(panel, (cx, cy), DIAL_RADIUS, (90, 90, 90), 1, cv2.LINE_AA)
+    for tick in range(10):
+      a = tick * 36 * pi / 180
+      p1 = (int(round(cx + (DIAL_RADIUS - 4) * cos(a))), int(round(cy + (DIAL_RADIUS - 4) * sin(a))))
+      p2 = (int(round(cx + DIAL_RADIUS * cos(a))), int(round(cy + DIAL_RADIUS * sin(a))))
+      cv2.line(panel, p1, p2, (90, 90, 90), 1, cv2.LINE_AA)
+    # a pointer tapering from the hub to the tip, so the needle's mass sits toward the hub
+    # (the reader points it from its center of mass toward its bounding box center)
+    a = needle_angle(spec, value)
+    half = NEEDLE_WIDTH / 2
+    pointer = np.array([
+      [cx + NEEDLE_LENGTH * cos(a), cy + NEEDLE_LENGTH * sin(a)],
+      [cx - half * sin(a), cy + half * cos(a)],
+      [cx + half * sin(a), cy - half * cos(a)],
+    ])
+    cv2.fillPoly(panel, [np.int32(np.round(pointer))], (20, 20, 20), cv2.LINE_AA)
+    cv2.circle(panel, (cx, cy), HUB_RADIUS, (20, 20, 20), -1, cv2.LINE_AA)
+  return panel
+
+def render_frame(reading, rng, skew=0.04, rotation=4, noise=2.0, lighting=0.15):
+  '''
+    a full camera frame: the panel warped into a darker scene with random placement,
+    rotation (degrees), perspective skew (fraction of panel size), sensor noise (stddev)
+    and a lighting gradient across the scene
+  '''
+  panel = draw_panel(dial_values(reading))
+
+  scale = rng.uniform(1.0, 1.3)
+  w, h = PROJECTED_WIDTH * scale, PROJECTED_HEIGHT * scale
+  cx = FRAME_WIDTH / 2 + rng.uniform(-40, 40)
+  cy = FRAME_HEIGHT / 2 + rng.uniform(-30, 30)
+  # unskew_dials_complex maps minAreaRect's boxPoints straight onto the projected corners,
+  # which only comes out upright for a panel seen upside down and turned slightly clockwise
+  theta = pi + rng.uniform(min(0.5, rotation), rotation) * pi / 180
+  corners = np.array([[-w / 2, -h / 2], [w / 2, -h / 2], [w / 2, h / 2], [-w / 2, h / 2]])
+  corners += rng.uniform(-skew, skew, corners.shape) * [w, h]
+  rot = np.array([[cos(theta), -sin(theta)], [sin(theta), cos(theta)]])
+  dst = np.float32(corners @ rot.T + [cx, cy])
+  src = np.float32([[0, 0], [PROJECTED_WIDTH, 0], [PROJECTED_WIDTH, PROJECTED_HEIGHT], [0, PROJECTED_HEIGHT]])
+  matrix = cv2.getPerspectiveTransform(src, dst)
+
+  background = rng.uniform(40, 140)
+  frame = np.full((FRAME_HEIGHT, FRAME_WIDTH, 3), background, np.float32)
+  mask = cv2.warpPerspective(np.ones(panel.shape[:2], np.float32), matrix, (FRAME_WIDTH, FRAME_HEIGHT))[..., None]
+  warped = cv2.warpPerspective(panel, matrix, (FRAME_WIDTH, FRAME_HEIGHT)).astype(np.float32)
+  frame = frame * (1 - mask) + warped * mask
+
+  # the panel is lit brighter than the scene (the reader finds it as the region over 248), so
+  # lighting only shifts how dark the needles and background look
+  gradient = np.linspace(-lighting, lighting, FRAME_WIDTH, dtype=np.float32)[None, :, None] * rng.choice([-1, 1])
+  frame = frame * (1.1 + gradient)
+  frame += rng.normal(0, noise, frame.shape)
+  return np.clip(frame, 0, 255).astype(np.uint8)
+
+def generate(outdir, count, seed=0, start=datetime(2023, 1, 1), interval=10, max_usage=MAX_USAGE, **render_options):
+  '''
+    write count frames named like the capture host does (gas-meter-%Y-%m-%d_%H-%M-%S.jpg) and
+    yield the ground truth record for each. between frames either nothing or up to max_usage
+    cf is used; above MAX_USAGE the 0.5 cf test dial can turn far enough that process_series.py
+    reads it as going backwards (one appliance burning for 10s is ~0.54 cf)
+  '''
+  rng = np.random.default_rng(seed)
+  os.makedirs(outdir, exist_ok=True)
+  reading = rng.uniform(0, 900000)
+  for i in range(count):
+    reading += rng.choice([0, rng.uniform(0, max_usage)])
+    date = start + timedelta(seconds=interval * i)
+    filename = os.path.join(outdir, date.strftime('gas-meter-%Y-%m-%d_%H-%M-%S.jpg'))
+    cv2.imwrite(filename, render_frame(reading, rng, **render_options))
+    values = dial_values(reading)
+    yield {
+      'imagesrc': filename,
+      'date': str(date),
+      'reading': reading,
+      'test': dict((spec['factor'], value * spec['factor']) for spec, value in zip(DIALS, values) if spec.get('test')),
+    }
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'Render synthetic gas meter images with known readings'
+  )
+  parser.add_argument('outdir')
+  parser.add_argument('-n', '--count', type=int, default=100)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--skew', type=float, default=0.04, help='perspective skew as a fraction of the panel size')
+  parser.add_argument('--rotation', type=float, default=4, help='max rotation in degrees')
+  parser.add_argument('--noise', type=float, default=2.0, help='stddev of gaussian sensor noise')
+  parser.add_argument('--lighting', type=float, default=0.15, help='strength of the lighting gradient')
+  parser.add_argument('--max_usage', type=float, default=MAX_USAGE, help='most cf used between frames')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args()
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+
+  # ground truth goes to stdout as ndjson, one record per image
+  with record_io.RecordWriter(sys.stdout) as writer:
+    for truth in generate(args.outdir, args.count, args.seed,
+        skew=args.skew, rotation=args.rotation, noise=args.noise, lighting=args.lighting, max_usage=args.max_usage):
+      writer.write(truth)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -2,14 +2,14 @@
 
 import sys
 import os
-import json
 import math
-from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 import argparse
+import render_cache
+import record_io
 
 def zoom_factory(ax,base_scale = 2.):
+  import matplotlib.pyplot as plt
+
   def zoom_fun(event):
     cur_xlim = ax.get_xlim()
     xdata = event.xdata
@@ -54,39 +54,44 @@ def hover(annot, fig, ax, plots):
         fig.canvas.draw_idle()
   return h
 
+# hour of day -> category, indexed by the local hour in the 'hour' field
+HOURCATS = ['overnight'] * 5 + ['AM'] * 2 + ['daytime'] * 14 + ['PM'] * 2 + ['overnight']
+
+def load_hourlies(file):
+  '''
+    read a joined hourly file (hourly cf + outside temp) into typed columns
+  '''
+  # pandas/numpy are imported where they are used so --help and render cache hits start quickly
+  import numpy as np
+  import pandas as pd
+
+  # only the four columns used are kept from each record
+  columns = record_io.read_columns(file, ['hour', 'utcdatetime', 'temp', 'cf'])
+  hourlies = pd.DataFrame({
+    'hour': pd.Series(columns['hour'], dtype=str),
+    'timestamp': pd.to_datetime(columns['utcdatetime']),
+    'temp': np.array(columns['temp'], dtype=np.float64),
+    'cf': np.array(columns['cf'], dtype=np.float64),
+  })
+  hourlies['hourcat'] = np.array(HOURCATS)[hourlies['hour'].str.slice(11, 13).astype(np.intp).to_numpy()]
+  return hourlies
+
 def process_file(file, options={}):
-  temps = []
-  cfs = []
-  hours = []
-  timestamps = []
-  hourcats = []
-  for line in file:
-    entry = json.loads(line)
-    cfs.append(entry['cf'])
-    temps.append(entry['temp'])
-    hours.append(entry['hour'])
-    timestamps.append(datetime.fromisoformat(entry['utcdatetime']))
-    hour = int(entry['hour'][11:13])
-    if hour in range(7,21,1):
-      hourcat = 'daytime'
-    elif hour in [5,6]:
-      hourcat = 'AM'
-    elif hour in [21,22]:
-      hourcat = 'PM'
-    else:
-      hourcat = 'overnight'
-
-    hourcats.append(hourcat)
+  hourlies = load_hourlies(file)
 
   if options.get('action') == 'scatter':
-    scatter(hours, temps, cfs, hourcats)
+    scatter(hourlies)
   elif options.get('action') == 'ts':
-    ts(timestamps, temps, cfs)
+    ts(hourlies)
 
-def ts(timestamps, temps, cfs):
+def ts(hourlies):
+  import numpy as np
+  import matplotlib.pyplot as plt
+  from downsample import plot_lod
 
-  hdds = [max(0,65 - t) for t in temps]
-  cfphdd = [(0 if hdd < 1 else 24*cf/hdd) for cf,hdd in zip(cfs,hdds)]
+  timestamps = hourlies['timestamp'].to_numpy()
+  hdds = np.maximum(0, 65 - hourlies['temp'].to_numpy())
+  cfphdd = np.where(hdds < 1, 0, 24 * hourlies['cf'].to_numpy() / np.maximum(hdds, 1))
 
   fig, ax1 = plt.subplots()
 
@@ -94,25 +99,26 @@ def ts(timestamps, temps, cfs):
 
   color = 'red'
   ax1.set_ylabel('HDD', color=color)
-  ax1.plot(timestamps, hdds, color=color)
+  plot_lod(ax1, timestamps, hdds, color=color)
   ax1.tick_params(axis='y', labelcolor=color)
 
   ax3 = ax1.twinx()
   color = 'green'
   ax3.set_ylabel('cf/hdd', color=color)
-  ax3.plot(timestamps, cfphdd, color=color)
+  plot_lod(ax3, timestamps, cfphdd, color=color)
   ax3.tick_params(axis='y', labelcolor=color)
 
   scale = 1.5
   f = zoom_factory(plt.gca(),base_scale = scale)
 
-  plt.show()
+def scatter(hourlies):
+  import pandas as pd
+  import matplotlib.pyplot as plt
 
-def scatter(hours, temps, cfs, hourcats):
-  df = pd.DataFrame({'x': temps,
-                   'y': cfs,
-                   'z': hourcats,
-                   'h': hours})
+  df = pd.DataFrame({'x': hourlies['temp'],
+                   'y': hourlies['cf'],
+                   'z': hourlies['hourcat'],
+                   'h': hourlies['hour']})
   groups = df.groupby('z')
 
   fig, ax = plt.subplots()
@@ -148,9 +154,6 @@ def scatter(hours, temps, cfs, hourcats):
   f = zoom_factory(ax,base_scale = scale)
 
 
-  plt.show()
-
-
 def main(argv):
 
   parser = argparse.ArgumentParser(
@@ -160,13 +163,18 @@ def main(argv):
   parser.add_argument('action', choices=['scatter', 'ts'])
   parser.add_argument('filename', nargs='+') # positional argument
   parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+  render_cache.add_render_arguments(parser)
 
   args = parser.parse_args()
 
   global DEBUG
   if args.debug:
     DEBUG = True
-    # pass
+    render_cache.DEBUG = True
+
+  if args.output and len(args.filename) > 1:
+    # each input is drawn in a figure of its own and only one figure can be saved
+    parser.error('--output takes a single filename')
 
   for filename in args.filename:
     if not os.path.exists(filename):
@@ -174,7 +182,16 @@ def main(argv):
       printerr()
       printerr(parser.format_help())
       sys.exit(1)
+
+  if args.output:
+    render_cache.render(args.output, args.filename, vars(args),
+      lambda: [process_file(open(filename), vars(args)) for filename in args.filename], __file__)
+    return
+
+  for filename in args.filename:
     process_file(open(filename), vars(args))
+    import matplotlib.pyplot as plt
+    plt.show()
 
 if __name__ == '__main__':
   main(sys.argv[1:])
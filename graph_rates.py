@@ -2,13 +2,15 @@
 
 import sys
 import os
-import json
 import math
 from datetime import datetime
 import argparse
-import matplotlib.pyplot as plt
+import render_cache
+import record_io
 
 def zoom_factory(ax,base_scale = 2.):
+  import matplotlib.pyplot as plt
+
   def zoom_fun(event):
     cur_xlim = ax.get_xlim()
     xdata = event.xdata
@@ -27,8 +29,8 @@ def zoom_factory(ax,base_scale = 2.):
 
 def get_thermostat_temps(thermostat_file):
   temps = dict()
-  for line in thermostat_file:
-    d = json.loads(line)
+  # responses without devices (errors, expired tokens) are skipped without being decoded
+  for d in record_io.read_records(thermostat_file, contains='devices'):
     if 'devices' in d['response_body']:
       for i,dev in enumerate(d['response_body']['devices']):
         if i not in temps:
@@ -40,12 +42,16 @@ def get_thermostat_temps(thermostat_file):
   return temps
 
 def process_file(file, options={}):
+  # pyplot and numpy are imported here rather than at the top so --help and render cache hits
+  # start quickly
+  import matplotlib.pyplot as plt
+  from downsample import plot_lod
+
   rate_times = []
   rate_vals = []
   thermostat_temps = None if not options.get('thermostat') else get_thermostat_temps(open(options.get('thermostat')))
 
-  for line in file:
-    diff = json.loads(line)
+  for diff in record_io.read_records(file):
     rate_vals.append(diff['rate'])
     rate_times.append(datetime.fromtimestamp(diff['timestamp']))
 
@@ -55,22 +61,20 @@ def process_file(file, options={}):
 
   color = 'blue'
   ax1.set_ylabel('CF', color=color)
-  ax1.plot(rate_times, rate_vals, color=color, ds="steps-pre")
+  plot_lod(ax1, rate_times, rate_vals, color=color, ds="steps-pre")
   ax1.tick_params(axis='y', labelcolor=color)
 
   if thermostat_temps is not None:
     ax2 = ax1.twinx()
     color = 'green'
     ax2.set_ylabel('thermostat temp', color=color)
-    ax2.plot(thermostat_temps[1]['time'], thermostat_temps[1]['temp'], color=color)
-    ax2.plot(thermostat_temps[0]['time'], thermostat_temps[0]['temp'], color='red')
+    plot_lod(ax2, thermostat_temps[1]['time'], thermostat_temps[1]['temp'], color=color)
+    plot_lod(ax2, thermostat_temps[0]['time'], thermostat_temps[0]['temp'], color='red')
     ax2.tick_params(axis='y', labelcolor=color)
 
   scale = 1.5
   f = zoom_factory(plt.gca(),base_scale = scale)
 
-  plt.show()
-
 DEBUG = False
 
 def debug(*args, **kwargs):
@@ -88,15 +92,21 @@ def main(argv):
   parser.add_argument('filename', nargs='+') # positional argument
   parser.add_argument('--thermostat')
   parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+  render_cache.add_render_arguments(parser)
 
   args = parser.parse_args()
 
   global DEBUG
   if args.debug:
     DEBUG = True
+    render_cache.DEBUG = True
+
 
 
 
+  if args.output and len(args.filename) > 1:
+    # each input is drawn in a figure of its own and only one figure can be saved
+    parser.error('--output takes a single filename')
 
   for filename in args.filename:
     if not os.path.exists(filename):
@@ -104,8 +114,18 @@ def main(argv):
       printerr()
       printerr(parser.format_help())
       sys.exit(1)
+
+  if args.output:
+    inputs = args.filename + ([args.thermostat] if args.thermostat else [])
+    render_cache.render(args.output, inputs, vars(args),
+      lambda: [process_file(open(filename), vars(args)) for filename in args.filename], __file__)
+    return
+
+  for filename in args.filename:
     #TODO handle multiple files
     process_file(open(filename), vars(args))
+    import matplotlib.pyplot as plt
+    plt.show()
 
 if __name__ == '__main__':
   main(sys.argv[1:])
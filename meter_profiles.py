@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+'''
+  per-meter calibration profiles. a config file looks like
+
+  {
+    "profiles": [
+      { "name": "gas", "pattern": "gas-meter-*.jpg", "workers": 2 },
+      { "name": "water", "pattern": "*/cam2/water-meter-*.jpg", "dials": [...], "unskew_threshold": 235 }
+    ]
+  }
+
+  each profile is laid over read_meter_images.DEFAULT_PROFILE, so it only has to name what
+  differs from the gas meter. frames are routed to the first profile whose pattern matches:
+  patterns containing a '/' are matched against the whole path, others against the basename.
+'''
+
+import os
+import json
+import fnmatch
+
+REQUIRED_DIAL_KEYS = ['center', 'clockwise', 'factor']
+
+def load_profiles(path, defaults):
+  with open(path) as f:
+    config = json.load(f)
+
+  profiles = []
+  for p in config.get('profiles', []):
+    profile = dict(defaults)
+    profile.update(p)
+    validate_profile(profile)
+    if profile['name'] in [existing['name'] for existing in profiles]:
+      raise(Exception('duplicate meter profile name in {}: {}'.format(path, profile['name'])))
+    profiles.append(profile)
+
+  if not profiles:
+    raise(Exception('no meter profiles found in ' + path))
+  return profiles
+
+def validate_profile(profile):
+  if 'name' not in profile:
+    raise(Exception('meter profile is missing a name: ' + str(profile)))
+  for dial in profile['dials']:
+    missing = [key for key in REQUIRED_DIAL_KEYS if key not in dial]
+    if missing:
+      raise(Exception('dial in meter profile {} is missing {}: {}'.format(profile['name'], missing, dial)))
+  if int(profile['workers']) < 1:
+    raise(Exception('meter profile {} needs at least one worker'.format(profile['name'])))
+
+def route(filename, profiles):
+  for profile in profiles:
+    pattern = profile['pattern']
+    target = filename if '/' in pattern else os.path.basename(filename)
+    if fnmatch.fnmatch(target, pattern):
+      return profile
+  return None
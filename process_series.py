@@ -2,10 +2,13 @@
 
 import sys
 import os
-import json
 import math
+import time
+import argparse
 from datetime import datetime
 import pytz
+import record_io
+from usage_detector import UsageDetector, APPLIANCES, load_appliances
 
 # there might be noise in readings. If a dial jumps back more than this fraction, assume it has completed a full revolution
 MAX_JITTER = 0.5
@@ -50,7 +53,6 @@ def get_diff(entry, last_diff, dial_to_check):
             'hour': datetime.strftime(date, '%Y-%m-%dT%H%Z'),
             'timestamp': timestamp
           }
-          print(json.dumps(diff))
           return diff
       else:
         # this line is the first entry in the input
@@ -60,30 +62,123 @@ def get_diff(entry, last_diff, dial_to_check):
           'timestamp': timestamp
         }
 
-def process_file(file):
+def follow_lines(filename, poll=1.0, idle=None):
+  '''
+    yield lines of filename as they are appended, like tail -f from the start of the file.
+    a trailing partial line is held back until its newline arrives, and the file is reopened if
+    it is replaced or truncated. idle(seconds_waited) is called whenever there is no new data,
+    first with 0 as soon as the end of the file is reached and then after every poll.
+  '''
+  file = open(filename, 'r')
+  partial = ''
+  waited = 0
+  while True:
+    line = file.readline()
+    if line:
+      partial += line
+      if partial.endswith('\n'):
+        yield partial
+        partial = ''
+        waited = 0
+      continue
+
+    try:
+      st = os.stat(filename)
+      replaced = st.st_ino != os.fstat(file.fileno()).st_ino or st.st_size < file.tell()
+    except FileNotFoundError:
+      replaced = False
+    if replaced:
+      debug('{} was replaced or truncated; reopening'.format(filename))
+      file.close()
+      file = open(filename, 'r')
+      partial = ''
+      continue
+
+    if idle is not None:
+      idle(waited)
+    time.sleep(poll)
+    waited += poll
+
+def process_file(file, options={}):
   last_diff = None
-  for line in file:
-    entry = json.loads(line)
-    dial_to_check = '0.2'
+  detector = options.get('detector')
+  # in follow mode main flushes the writer whenever the input is caught up
+  writer = options.get('writer') or record_io.RecordWriter(sys.stdout)
+  dial_to_check = '0.2'
+  for entry in record_io.read_records(file):
     diff = get_diff(entry, last_diff, dial_to_check)
     if diff is not None:
       last_diff = diff
+      if 'rate' in diff:
+        writer.write(diff)
+        if detector is not None:
+          detector.add(diff)
+  writer.flush()
+  if detector is not None:
+    detector.finish()
 
+DEBUG = False
 
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
 
-def main(argv):
-
-  filename = argv[0] if len(argv) > 0 else ""
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
 
-  if not os.path.exists(filename):
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'create a time series of gas usage rates from meter readings'
+  )
+  parser.add_argument('filename')
+  parser.add_argument('-f', '--follow', action='store_true', help='keep reading as the readings file grows')
+  parser.add_argument('--poll', type=float, default=1.0, help='seconds between checks for new readings (--follow)')
+  parser.add_argument('--detect', action='store_true', help='detect burns and continuous flow; events go to --events')
+  parser.add_argument('--events', help='append detector events here as ndjson (default: stderr)')
+  parser.add_argument('--burn_threshold', type=float, help='cf/s above the baseline that counts as a burn')
+  parser.add_argument('--leak_window', type=float, help='seconds of unbroken flow before it is flagged')
+  parser.add_argument('--stall_timeout', type=float, help='seconds without new readings before an open burn is closed (--follow)')
+  parser.add_argument('--appliances', help='json file of appliance ratings used to label burns (see usage_detector.py)')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args(argv)
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+
+  if not os.path.exists(args.filename):
     print("Usage: python3 process_series.py <series.ndjson>")
     sys.exit(1)
-
-  file = open(filename, 'r')
+  if args.appliances and not args.detect:
+    parser.error('--appliances requires --detect')
+
+  options = vars(args)
+  if args.detect:
+    events = open(args.events, 'a') if args.events else sys.stderr
+    def emit(event):
+      events.write(record_io.dumps(event) + '\n')
+      events.flush()
+    appliances = load_appliances(args.appliances) if args.appliances else APPLIANCES
+    options['detector'] = UsageDetector(options, appliances=appliances, emit=emit)
+
+  if args.follow:
+    detector = options.get('detector')
+    writer = options['writer'] = record_io.RecordWriter(sys.stdout)
+    def idle(waited):
+      # rates are written in batches while catching up, and as soon as they are computed after
+      writer.flush()
+      # let a burn end if capture has stalled and no new rate will arrive to end it
+      if detector is not None:
+        detector.tick(waited)
+    file = follow_lines(args.filename, args.poll, idle)
+  else:
+    file = open(args.filename, 'rb')
 
   try:
-    process_file(file)
-  except BrokenPipeError as e:
+    process_file(file, options)
+  except (BrokenPipeError, KeyboardInterrupt) as e:
     pass
 
 if __name__ == '__main__':
@@ -7,12 +7,14 @@ import argparse
 import shutil
 import numpy as np
 from math import atan2, pi, floor, ceil
-from matplotlib import pyplot as plt
-from matplotlib import colors as mcolors
 from collections import OrderedDict
-import json
 import functools
 from datetime import datetime
+import stage_timings
+import record_io
+import meter_profiles
+from multiprocessing import Pool
+from contextlib import ExitStack
 
 PROJECTED_WIDTH = 400
 PROJECTED_HEIGHT = 225
@@ -20,6 +22,9 @@ MAX_DIAL_DISTANCE = 45
 
 DEBUG = False
 
+# per-stage timing; replaced by an enabled StageTimings when --timings is given
+TIMINGS = stage_timings.NO_TIMINGS
+
 DIALS = [
   # coord, clockwise, factor
   { "center": [93, 83], "clockwise": False, "factor": 100000 },
@@ -36,11 +41,28 @@ DIALS = [
   { "center": [153,174], "clockwise":  False, "test": True, "factor": 2 / 10 }
 ]
 
-def get_dial_spec(c, cntr):
+# calibration for the meter above. other meters/cameras are described by profiles in the same
+# shape loaded from a config file (see meter_profiles.py); any key they leave out falls back
+# to these values
+DEFAULT_PROFILE = {
+  "name": "gas",
+  "pattern": "*",
+  "dials": DIALS,
+  "projected_width": PROJECTED_WIDTH,
+  "projected_height": PROJECTED_HEIGHT,
+  "max_dial_distance": MAX_DIAL_DISTANCE,
+  "dial_area": [300, 700],
+  # tested this value on one image; seemed to work well
+  "unskew_threshold": 248,
+  "workers": 1
+}
+
+def get_dial_spec(c, cntr, profile=DEFAULT_PROFILE):
   area = cv2.contourArea(c)
-  if not 300 < area < 700:
+  min_area, max_area = profile["dial_area"]
+  if not min_area < area < max_area:
     return False
-  dial_list = [dial for dial in DIALS if (cv2.norm(np.array(cntr) - np.array(dial["center"]), cv2.NORM_L2) < MAX_DIAL_DISTANCE)]
+  dial_list = [dial for dial in profile["dials"] if (cv2.norm(np.array(cntr) - np.array(dial["center"]), cv2.NORM_L2) < profile["max_dial_distance"])]
   if len(dial_list) == 0:
     return False
   elif len(dial_list) > 1:
@@ -51,6 +73,9 @@ def get_dial_spec(c, cntr):
   return dial_list[0]
 
 def compare_thresholds(result):
+  # pyplot is slow to import and only needed here
+  from matplotlib import pyplot as plt
+
   # https://opencv24-python-tutorials.readthedocs.io/en/latest/py_tutorials/py_imgproc/py_thresholding/py_thresholding.html
   imgray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
   _, th1 = cv2.threshold(imgray, 188, 255, 0)
@@ -65,7 +90,7 @@ def compare_thresholds(result):
       plt.xticks([]),plt.yticks([])
   plt.show()
 
-def analyze_contour(pts, img, dials, filename):
+def analyze_contour(pts, img, dials, filename, profile=DEFAULT_PROFILE):
   #PCA
   sz = len(pts)
   data_pts = np.empty((sz, 2), dtype=np.float64)
@@ -78,7 +103,7 @@ def analyze_contour(pts, img, dials, filename):
     return
   center_of_mass = [M["m10"] / M["m00"], M["m01"] / M["m00"]]
 
-  dial = get_dial_spec(pts, center_of_mass)
+  dial = get_dial_spec(pts, center_of_mass, profile)
   if not dial:
     cv2.drawContours(img, [pts], 0, (0,199,255), 1)
     return
@@ -124,10 +149,10 @@ def get_dial_value(dial_spec, angle):
   return value
 
 
-def unskew_dials(original):
-  return unskew_dials_complex(original)
+def unskew_dials(original, profile=DEFAULT_PROFILE):
+  return unskew_dials_complex(original, profile)
 
-def unskew_dials_complex(original):
+def unskew_dials_complex(original, profile=DEFAULT_PROFILE):
   '''
     get histogram
     set threshold based on 2x size of dial panel
@@ -140,9 +165,8 @@ def unskew_dials_complex(original):
   # print([i[0] for i in histo])
   # print(sum([i[0] for i in histo]))
   # print(out.shape, out.shape[0] * out.shape[1])
-  # tested this value on one image; seemed to work well
   # TODO make this dynamic
-  thold = 248
+  thold = profile["unskew_threshold"]
 
   out = original.copy()
   imgray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
@@ -176,16 +200,17 @@ def unskew_dials_complex(original):
   # if input in [3, 27, 99]:
   #   sys.exit(130)
 
+  width, height = profile["projected_width"], profile["projected_height"]
   pts1 = np.float32(cv2.boxPoints(rect))
   pts2 = np.float32([
     [0, 0],
-    [PROJECTED_WIDTH, 0],
-    [PROJECTED_WIDTH, PROJECTED_HEIGHT],
-    [0, PROJECTED_HEIGHT]])
+    [width, 0],
+    [width, height],
+    [0, height]])
 
   # Apply Perspective Transform Algorithm
   matrix = cv2.getPerspectiveTransform(pts1, pts2)
-  return cv2.warpPerspective(original, matrix, (PROJECTED_WIDTH, PROJECTED_HEIGHT))
+  return cv2.warpPerspective(original, matrix, (width, height))
 
 
 def validate_value(value, previous_value):
@@ -221,7 +246,7 @@ def calculate_total(dials):
   })
 
 
-def add_caption(result, filename, dials):
+def add_caption(result, filename, dials, profile=None):
   timestamp = filename[-23:-4]
   outcome = calculate_total(dials)
   date = str(datetime.strptime(timestamp, '%Y-%m-%d_%H-%M-%S'))
@@ -231,39 +256,118 @@ def add_caption(result, filename, dials):
   )
   outcome['date'] = date
   outcome['imagesrc'] = filename
-  print(json.dumps(outcome))
+  if profile is not None:
+    outcome['meter'] = profile['name']
   cv2.putText(result, label, (0, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 1, cv2.LINE_AA)
+  return outcome
+
+def find_contours(result):
+  imgray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
+  thresh = cv2.adaptiveThreshold(imgray,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,11,2)
+  contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+  return contours
+
+def analyze_contours(contours, result, filename, profile=DEFAULT_PROFILE):
+  dials = {}
+  if contours:
+    for c in contours:
+      # Find the orientation of each shape
+      analyze_contour(c, result, dials, filename, profile)
+  return dials
 
 def analyze_raw(f, action='show', options={}):
-    original = cv2.imread(f.name)
-    result = unskew_dials(original)
+    # None unless profiles were loaded from a config, in which case readings are tagged with the meter
+    profile = options.get('profile')
+
+    with TIMINGS.stage('imread'):
+      original = cv2.imread(f.name)
+    with TIMINGS.stage('unskew'):
+      result = unskew_dials(original, profile or DEFAULT_PROFILE)
 
     # find the dials and measure the angles
-    imgray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
-    thresh = cv2.adaptiveThreshold(imgray,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,11,2)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-    dials = {}
-    if contours:
-        for c in contours:
-            # Find the orientation of each shape
-            analyze_contour(c, result, dials, f.name)
-
-    add_caption(result, f.name, dials)
-
-    if action == 'noop':
-      pass
-    elif action == 'archive':
-      if 'archive_dir' not in options:
-        raise(Exception('archive target not specified: ' + str(options)))
-      shutil.move(f.name, options['archive_dir'])
-    elif action == 'show':
-      cv2.imshow('skewed', result)
-      cv2.waitKey(0)
-    elif action == 'save':
-      new_filename = filename + '.ANNOTATED.JPG'
-      cv2.imwrite(new_filename, result)
-      debug('saved to', new_filename)
+    with TIMINGS.stage('find_contours'):
+      contours = find_contours(result)
+    TIMINGS.count('contours', len(contours))
+
+    with TIMINGS.stage('analyze_contours'):
+      dials = analyze_contours(contours, result, f.name, profile or DEFAULT_PROFILE)
+    TIMINGS.count('dials', len(dials))
+
+    with TIMINGS.stage('caption'):
+      outcome = add_caption(result, f.name, dials, profile)
+
+    with TIMINGS.stage(action):
+      if action == 'noop':
+        pass
+      elif action == 'archive':
+        if 'archive_dir' not in options:
+          raise(Exception('archive target not specified: ' + str(options)))
+        shutil.move(f.name, options['archive_dir'])
+      elif action == 'show':
+        cv2.imshow('skewed', result)
+        cv2.waitKey(0)
+      elif action == 'save':
+        new_filename = filename + '.ANNOTATED.JPG'
+        cv2.imwrite(new_filename, result)
+        debug('saved to', new_filename)
+    TIMINGS.end_frame(f.name)
+    return outcome
+
+def init_worker(debug, timings):
+  global DEBUG, TIMINGS
+  DEBUG = debug
+  if timings:
+    TIMINGS = stage_timings.StageTimings()
+
+def read_frame(filename, action, options):
+  # runs in a profile's worker process; timings are handed back for the parent to summarize
+  outcome = analyze_raw(open(filename), action, options)
+  return outcome, TIMINGS.last_frame
+
+def read_with_profiles(filenames, profiles, action, options, emit):
+  '''
+    route each frame to its meter profile and read it in that profile's worker pool. outcomes
+    are emitted in the order the frames were given. with archive, a frame is only moved by this
+    process once its reading has been emitted; workers finish frames out of order, so moving
+    them in the workers would lose readings of frames read ahead of one that fails. a frame
+    that fails to read is reported and left in place, and the rest are still emitted.
+  '''
+  if action == 'archive' and 'archive_dir' not in options:
+    raise(Exception('archive target not specified: ' + str(options)))
+  worker_action = 'noop' if action == 'archive' else action
+
+  routed = []
+  for filename in filenames:
+    profile = meter_profiles.route(filename, profiles)
+    if profile is None:
+      printerr('no meter profile matches {}; skipping'.format(filename))
+      continue
+    routed.append((filename, profile))
+
+  with ExitStack() as stack:
+    pools = {}
+    for profile in profiles:
+      if any(p is profile for _, p in routed):
+        pools[profile['name']] = stack.enter_context(
+          Pool(int(profile['workers']), initializer=init_worker, initargs=(DEBUG, TIMINGS.enabled)))
+
+    pending = [pools[profile['name']].apply_async(read_frame, (filename, worker_action, dict(options, profile=profile)))
+      for filename, profile in routed]
+    failed = 0
+    for (filename, profile), result in zip(routed, pending):
+      try:
+        outcome, frame = result.get()
+      except Exception as e:
+        printerr('could not read {}: {}'.format(filename, e))
+        failed += 1
+        continue
+      if frame is not None:
+        TIMINGS.record(frame)
+      emit(outcome)
+      if action == 'archive':
+        shutil.move(filename, options['archive_dir'])
+    if failed:
+      printerr('{} of {} frames could not be read'.format(failed, len(routed)))
 
 def debug(*args, **kwargs):
   if DEBUG:
@@ -280,9 +384,18 @@ def main(argv):
   parser.add_argument('action', choices=['noop', 'archive', 'show', 'save'])
   parser.add_argument('filename', nargs='+') # positional argument
   parser.add_argument('--archive_dir')
+  parser.add_argument('--profiles', help='json file of per-meter calibration profiles; frames are read by per-profile worker pools')
+  parser.add_argument('--output_dir', help='with --profiles, append readings to <output_dir>/readings.<meter>.ndjson instead of stdout')
   parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+  parser.add_argument('--timings', action='store_true', help='print per-stage timing percentiles to stderr at the end of the run')
+  parser.add_argument('--timings_ndjson', help='append per-frame stage timings to this file (implies --timings)')
+  parser.add_argument('--timings_prom', help='write a prometheus textfile-collector file at the end of the run (implies --timings)')
 
   args = parser.parse_args()
+  if args.profiles and args.action == 'show':
+    parser.error('show cannot be used with --profiles (frames are read in worker processes)')
+  if args.output_dir and not args.profiles:
+    parser.error('--output_dir requires --profiles')
 
   '''
   TODO
@@ -294,13 +407,47 @@ def main(argv):
   if args.debug:
     DEBUG = True
 
+  global TIMINGS
+  if args.timings or args.timings_ndjson or args.timings_prom:
+    TIMINGS = stage_timings.StageTimings(ndjson_file=open(args.timings_ndjson, 'a') if args.timings_ndjson else None)
+
   for filename in args.filename:
     if not os.path.exists(filename):
       printerr('could not find file: {}'.format(filename))
       printerr()
       printerr(parser.format_help())
       sys.exit(1)
-    analyze_raw(open(filename), args.action, vars(args))
+
+  # frames are archived as soon as they are read, so each reading is written out right away
+  # rather than batched: a killed run must not lose readings of frames it already moved. the
+  # image work dwarfs the cost of the writes anyway
+  stdout = record_io.RecordWriter(sys.stdout, batch_size=1)
+  if args.profiles:
+    profiles = meter_profiles.load_profiles(args.profiles, DEFAULT_PROFILE)
+    outputs = {}
+    def emit(outcome):
+      if args.output_dir:
+        if outcome['meter'] not in outputs:
+          outputs[outcome['meter']] = record_io.RecordWriter(open(os.path.join(args.output_dir, 'readings.{}.ndjson'.format(outcome['meter'])), 'a'), batch_size=1)
+        outputs[outcome['meter']].write(outcome)
+      else:
+        stdout.write(outcome)
+    try:
+      read_with_profiles(args.filename, profiles, args.action, vars(args), emit)
+    finally:
+      # readings already taken are written out even if a later frame fails
+      for output in outputs.values():
+        output.flush()
+        output.file.close()
+      stdout.flush()
+  else:
+    with stdout:
+      for filename in args.filename:
+        stdout.write(analyze_raw(open(filename), args.action, vars(args)))
+
+  TIMINGS.print_summary()
+  if args.timings_prom:
+    TIMINGS.write_prometheus(args.timings_prom)
 
 
 if __name__ == '__main__':
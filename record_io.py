@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+'''
+  ndjson record reading and writing shared by every stage.
+
+  - the fastest json backend that is installed is used (orjson, then ujson, then the stdlib
+    json module), so nothing has to be installed for the scripts to work
+  - lines are read in batches of about BATCH_BYTES and records are written in batches of
+    BATCH_RECORDS lines, rather than one read()/print() per record
+  - read_records can skip lines that cannot match before decoding them (contains). that is the
+    only decoding it saves: none of the backends can decode part of a line, so every line that
+    passes is decoded in full. read_columns gathers the fields a loader uses into columns.
+'''
+
+import json
+
+BACKENDS = ['orjson', 'ujson', 'json']
+
+# lines are pulled from the file this many bytes at a time
+BATCH_BYTES = 1 << 20
+
+# records are joined and written this many at a time
+BATCH_RECORDS = 1000
+
+def _numpy_default(obj):
+  # numpy scalars and arrays that end up in records (e.g. from the reader)
+  if hasattr(obj, 'tolist'):
+    return obj.tolist()
+  raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+def use_backend(name=None):
+  '''
+    switch to the named backend, or to the fastest installed one. returns the name in use.
+  '''
+  global BACKEND, dumps, loads
+  for candidate in ([name] if name else BACKENDS):
+    if candidate == 'orjson':
+      try:
+        import orjson
+      except ImportError:
+        continue
+      # the reader keys test dials by their float factor, which the stdlib turns into strings
+      options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+      dumps = lambda obj: orjson.dumps(obj, default=_numpy_default, option=options).decode()
+      loads = orjson.loads
+    elif candidate == 'ujson':
+      try:
+        import ujson
+      except ImportError:
+        continue
+      dumps = lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=_numpy_default)
+      loads = ujson.loads
+    elif candidate == 'json':
+      # json.dumps/json.loads build a new encoder whenever they are given options and check
+      # their argument on every call, so one encoder and decoder are set up here instead
+      encoder = json.JSONEncoder(default=_numpy_default)
+      decoder = json.JSONDecoder()
+      dumps = encoder.encode
+      loads = lambda line: decoder.decode(line.decode() if isinstance(line, bytes) else line)
+    else:
+      raise(Exception('unknown json backend: {} (expected one of {})'.format(candidate, ', '.join(BACKENDS))))
+    BACKEND = candidate
+    return BACKEND
+  raise(Exception('json backend {} is not installed'.format(name)))
+
+use_backend()
+
+def read_batches(file, batch_bytes=BATCH_BYTES):
+  '''
+    lists of lines of file, about batch_bytes at a time. anything without readlines (a
+    generator such as process_series.follow_lines, a list) is handed over a line at a time.
+  '''
+  if not hasattr(file, 'readlines'):
+    for line in file:
+      yield (line,)
+    return
+  while True:
+    lines = file.readlines(batch_bytes)
+    if not lines:
+      return
+    yield lines
+
+def read_records(file, contains=None, batch_bytes=BATCH_BYTES):
+  '''
+    decoded records of an ndjson file (text or binary) or iterable of lines. blank lines are
+    skipped.
+
+    contains: only decode lines with this substring in them. it is checked against the raw
+      line, so it can only narrow the input down; the caller still checks the decoded record.
+  '''
+  needles = None if contains is None else (contains, contains.encode())
+  for lines in read_batches(file, batch_bytes):
+    for line in lines:
+      if needles is not None and needles[isinstance(line, bytes)] not in line:
+        continue
+      if line.isspace():
+        continue
+      yield loads(line)
+
+def read_columns(file, fields, contains=None, batch_bytes=BATCH_BYTES):
+  '''
+    {field: [value of each record]} for the given fields, None where a record lacks one. ready
+    to hand to numpy/pandas, and a good deal faster than pandas.read_json(lines=True). records
+    are still decoded in full; only the fields asked for are kept.
+  '''
+  columns = dict((key, []) for key in fields)
+  for record in read_records(file, contains=contains, batch_bytes=batch_bytes):
+    for key, column in columns.items():
+      column.append(record.get(key))
+  return columns
+
+class RecordWriter:
+  '''
+    buffers records and writes them to file as ndjson, batch_size lines at a time. flush()
+    writes whatever is buffered (follow mode calls it whenever it catches up with its input);
+    leaving a with block flushes without closing the file.
+  '''
+  def __init__(self, file, batch_size=BATCH_RECORDS):
+    self.file = file
+    self.batch_size = batch_size
+    self.lines = []
+
+  def write(self, record):
+    self.lines.append(dumps(record))
+    if len(self.lines) >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    if self.lines:
+      self.lines.append('')
+      self.file.write('\n'.join(self.lines))
+      self.lines = []
+    self.file.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.flush()
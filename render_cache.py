@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import shutil
+import glob
+import hashlib
+
+# bump to invalidate every cached chart
+CACHE_VERSION = 1
+
+# shared modules that affect how charts are drawn. they are fingerprinted into every cache key
+# along with the entry script, so changing one re-renders charts without bumping CACHE_VERSION
+APP_PATH = os.path.dirname(os.path.abspath(__file__))
+DRAWING_MODULES = ['render_cache.py', 'downsample.py', 'record_io.py']
+
+def add_render_arguments(parser):
+  parser.add_argument('-o', '--output', help='render to this .png/.svg/.pdf instead of opening a window')
+  parser.add_argument('--cache_dir', help='where rendered charts are cached (default: .render-cache next to the output)')
+  parser.add_argument('--cache_key', choices=['mtime', 'content'], default='mtime',
+    help='identify inputs by size+mtime (fast) or by a hash of their content')
+  parser.add_argument('--no_cache', action='store_true', help='always re-render')
+
+# argparse options that only affect how/where a chart is written, not what is drawn
+RENDER_OPTIONS = ['output', 'cache_dir', 'cache_key', 'no_cache', 'debug']
+
+def chart_params(options):
+  return dict((k, v) for k, v in options.items() if k not in RENDER_OPTIONS and k != 'filename')
+
+def file_fingerprint(filename, key_mode='mtime'):
+  if key_mode == 'content':
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        h.update(block)
+    return h.hexdigest()
+  st = os.stat(filename)
+  return [st.st_size, st.st_mtime_ns]
+
+def cache_key(input_files, params, script, output, key_mode='mtime'):
+  '''
+    hash everything that determines the rendered chart: the inputs, the chart parameters,
+    the script that draws it (and the shared modules it draws with) and the output format
+  '''
+  description = {
+    'version': CACHE_VERSION,
+    'script': [os.path.basename(script), file_fingerprint(script, 'content')],
+    'modules': [[name, file_fingerprint(os.path.join(APP_PATH, name), 'content')] for name in DRAWING_MODULES],
+    'inputs': [[os.path.abspath(f), file_fingerprint(f, key_mode)] for f in input_files],
+    'params': params,
+    'format': os.path.splitext(output)[1].lower(),
+  }
+  return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def cache_slot(output, params):
+  '''
+    charts rendered for the same output path with the same parameters share a slot; only the
+    newest chart in a slot is worth keeping
+  '''
+  description = {'output': os.path.abspath(output), 'params': params}
+  return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def cached_path(output, slot, key, cache_dir=None):
+  if cache_dir is None:
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(output)), '.render-cache')
+  return os.path.join(cache_dir, '{}-{}{}'.format(slot, key, os.path.splitext(output)[1].lower()))
+
+def evict(cached, slot):
+  '''
+    remove the other charts cached in slot, which were rendered from inputs that have since
+    changed
+  '''
+  for stale in glob.glob(os.path.join(os.path.dirname(cached), slot + '-*')):
+    if stale != cached and not stale.endswith('.tmp' + os.path.splitext(cached)[1]):
+      debug('render cache evict', os.path.basename(stale))
+      try:
+        os.remove(stale)
+      except FileNotFoundError:
+        pass
+
+def render(output, input_files, options, draw, script):
+  '''
+    write the chart drawn by draw() to output using the Agg backend. if a chart with the same
+    cache key was already rendered it is copied from the cache instead and draw() is never
+    called. returns True when the output was served from the cache.
+  '''
+  params = chart_params(options)
+  key = cache_key(input_files, params, script, output, options.get('cache_key', 'mtime'))
+  slot = cache_slot(output, params)
+  cached = cached_path(output, slot, key, options.get('cache_dir'))
+
+  if not options.get('no_cache') and os.path.exists(cached):
+    debug('render cache hit', key)
+    if os.path.abspath(cached) != os.path.abspath(output):
+      shutil.copyfile(cached, output)
+    return True
+
+  debug('render cache miss', key)
+  import matplotlib.pyplot as plt
+  plt.switch_backend('Agg')
+  draw()
+
+  os.makedirs(os.path.dirname(cached), exist_ok=True)
+  # write to a temporary name first so a crash never leaves a truncated chart in the cache
+  tmp = '{}.{}.tmp{}'.format(cached, os.getpid(), os.path.splitext(cached)[1])
+  plt.savefig(tmp)
+  plt.close('all')
+  os.replace(tmp, cached)
+  evict(cached, slot)
+  shutil.copyfile(cached, output)
+  return False
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import hashlib
+import argparse
+import record_io
+
+# outside temperature (F) below which an hour counts toward heating degree hours
+HDD_BASE_TEMP = 65
+
+PERIODS = ['hourly', 'daily', 'monthly']
+
+# how many bytes before the resume offset are fingerprinted to detect a rewritten source
+FINGERPRINT_BYTES = 4096
+
+# state file layout:
+# {
+#   'sources': { <abspath>: {'offset': bytes consumed, 'fingerprint': sha1 of the bytes before offset},
+#                '-': {<mark field>: newest value rolled up from stdin} },
+#   'temps':   { <hour>: outside temp used for that hour's hdh },
+#   'hourly':  { '2023-01-05T14EST': {'cf': .., 'hdh': .., 'samples': ..} },
+#   'daily':   { '2023-01-05': {...} },
+#   'monthly': { '2023-01': {...} }
+# }
+# hour keys are the 'hour' field written by process_series.py and decode_metar_weather_data.py
+
+def empty_state():
+  return dict([('sources', {}), ('temps', {})] + [(period, {}) for period in PERIODS])
+
+def load_state(statefile):
+  if not os.path.exists(statefile):
+    return empty_state()
+  with open(statefile) as f:
+    return json.load(f)
+
+def save_state(state, statefile):
+  tmp = '{}.{}.tmp'.format(statefile, os.getpid())
+  with open(tmp, 'w') as f:
+    json.dump(state, f)
+  os.replace(tmp, statefile)
+
+def period_keys(hour):
+  return {'hourly': hour, 'daily': hour[:10], 'monthly': hour[:7]}
+
+def add_to_periods(state, hour, cf=0, hdh=0, samples=0):
+  for period, key in period_keys(hour).items():
+    row = state[period].setdefault(key, {'cf': 0, 'hdh': 0, 'samples': 0})
+    row['cf'] += cf
+    row['hdh'] += hdh
+    row['samples'] += samples
+
+def add_rate(state, rate):
+  add_to_periods(state, rate['hour'], cf=rate['delta'], samples=1)
+
+def add_temp(state, weather):
+  if weather.get('temp') is None:
+    return
+  hour = weather['hour']
+  previous = state['temps'].get(hour)
+  hdh = max(0, HDD_BASE_TEMP - weather['temp'])
+  if previous is not None:
+    # a later report for the same hour replaces the earlier one
+    hdh -= max(0, HDD_BASE_TEMP - previous)
+  state['temps'][hour] = weather['temp']
+  add_to_periods(state, hour, hdh=hdh)
+
+def fingerprint(f, offset):
+  start = max(0, offset - FINGERPRINT_BYTES)
+  f.seek(start)
+  return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+def read_new_lines(filename, source):
+  '''
+    yield complete lines appended to filename since the recorded offset, then advance the
+    offset. a trailing line without a newline is left for the next run (its writer may still
+    be mid-line).
+  '''
+  with open(filename, 'rb') as f:
+    offset = source.get('offset', 0)
+    if os.fstat(f.fileno()).st_size < offset or fingerprint(f, offset) != source.get('fingerprint', fingerprint(f, 0)):
+      raise Exception('{} was rewritten since it was last rolled up; rerun with --rebuild'.format(filename))
+    f.seek(offset)
+    for line in f:
+      if not line.endswith(b'\n'):
+        break
+      offset += len(line)
+      yield line
+    source['offset'] = offset
+    source['fingerprint'] = fingerprint(f, offset)
+
+def update(state, filenames, add, mark):
+  '''
+    roll up the new records of each file. stdin has no offset to resume from, and
+    process_series.py re-emits every rate of a file on each run, so records from stdin are
+    only rolled up when their mark field (timestamp, or utcdatetime for weather) is newer than
+    anything stdin has given before. stdin must therefore arrive in time order.
+  '''
+  count = 0
+  for filename in filenames:
+    if filename == '-':
+      high_water = state['sources'].setdefault('-', {})
+      for record in record_io.read_records(sys.stdin.buffer):
+        if high_water.get(mark) is not None and record[mark] <= high_water[mark]:
+          continue
+        high_water[mark] = record[mark]
+        add(state, record)
+        count += 1
+      continue
+    source = state['sources'].setdefault(os.path.abspath(filename), {})
+    for record in record_io.read_records(read_new_lines(filename, source)):
+      add(state, record)
+      count += 1
+  return count
+
+def rows(state, period):
+  for key in sorted(state[period]):
+    row = state[period][key]
+    yield {
+      'period': key,
+      'cf': row['cf'],
+      'hdh': row['hdh'],
+      'samples': row['samples'],
+      # cf per heating degree day, as in graph_hourlies.ts
+      'cfphdd': None if row['hdh'] < 1 else 24 * row['cf'] / row['hdh'],
+    }
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'maintain hourly/daily/monthly rollups of gas usage and heating degree hours'
+  )
+  parser.add_argument('action', choices=['update', 'dump'])
+  parser.add_argument('statefile')
+  parser.add_argument('--rates', nargs='*', default=[], help='process_series.py output ("-" for stdin, which must be in time order)')
+  parser.add_argument('--weather', nargs='*', default=[], help='decode_metar_weather_data.py ndjson output')
+  parser.add_argument('--period', choices=PERIODS, default='daily')
+  parser.add_argument('--rebuild', action='store_true', help='discard the existing rollups first')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args()
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+
+  for filename in args.rates + args.weather:
+    if filename != '-' and not os.path.exists(filename):
+      printerr('could not find file: {}'.format(filename))
+      printerr()
+      printerr(parser.format_help())
+      sys.exit(1)
+
+  state = empty_state() if args.rebuild else load_state(args.statefile)
+
+  if args.action == 'update':
+    rate_count = update(state, args.rates, add_rate, 'timestamp')
+    temp_count = update(state, args.weather, add_temp, 'utcdatetime')
+    debug('rolled up {} rates and {} weather reports'.format(rate_count, temp_count))
+    save_state(state, args.statefile)
+  elif args.action == 'dump':
+    try:
+      with record_io.RecordWriter(sys.stdout) as writer:
+        for row in rows(state, args.period):
+          writer.write(row)
+    except BrokenPipeError as e:
+      pass
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+'''
+  manifest-driven batch reading of meter images, shared between processes and hosts.
+
+  plan   groups frames into one shard per image prefix and day and writes JOBDIR/manifest.json
+  work   claims shards through lock files in JOBDIR/locks, reads their frames and commits each
+         shard's readings atomically to JOBDIR/shards/<shard>.ndjson. frames that cannot be
+         read are logged, left out (and not archived) and listed in JOBDIR/failed/<shard>.json
+  merge  concatenates committed shards in manifest order
+  status counts done, claimed and pending shards and the frames that failed to read
+
+  JOBDIR only has to be a directory every worker can see (e.g. an nfs/sshfs mount). a shard is
+  done exactly when its output file exists, so a crashed worker leaves no partial output and its
+  shard is picked up again once its lock goes stale.
+'''
+
+import sys
+import os
+import json
+import time
+import socket
+import shutil
+import argparse
+from multiprocessing import Pool
+import meter_profiles
+import record_io
+
+# a claimed shard whose lock has not been touched for this many seconds is assumed abandoned
+DEFAULT_LEASE = 15 * 60
+
+def manifest_path(jobdir):
+  return os.path.join(jobdir, 'manifest.json')
+
+def shard_output(jobdir, shard_id):
+  return os.path.join(jobdir, 'shards', shard_id + '.ndjson')
+
+def shard_lock(jobdir, shard_id):
+  return os.path.join(jobdir, 'locks', shard_id + '.lock')
+
+def shard_failures(jobdir, shard_id):
+  return os.path.join(jobdir, 'failed', shard_id + '.json')
+
+def shard_id(filename):
+  # gas-meter-2023-01-05_12-00-00.jpg -> gas-meter-2023-01-05 (same timestamp slice as add_caption)
+  basename = os.path.basename(filename)
+  return basename[:-23] + basename[-23:-13]
+
+def write_atomic(path, text):
+  tmp = '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+  with open(tmp, 'w') as f:
+    f.write(text)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, path)
+
+def plan(jobdir, filenames, options):
+  shards = {}
+  for filename in filenames:
+    shards.setdefault(shard_id(filename), []).append(os.path.abspath(filename))
+  manifest = {
+    'created': time.time(),
+    'profiles': options.get('profiles') and os.path.abspath(options['profiles']),
+    'shards': [{'id': key, 'frames': sorted(shards[key])} for key in sorted(shards)],
+  }
+  os.makedirs(os.path.join(jobdir, 'shards'), exist_ok=True)
+  os.makedirs(os.path.join(jobdir, 'locks'), exist_ok=True)
+  os.makedirs(os.path.join(jobdir, 'failed'), exist_ok=True)
+  write_atomic(manifest_path(jobdir), json.dumps(manifest, indent=2))
+  return manifest
+
+def load_manifest(jobdir):
+  with open(manifest_path(jobdir)) as f:
+    return json.load(f)
+
+def claim(jobdir, shard, lease):
+  '''
+    try to take the lock for a shard. O_EXCL creation is atomic, so only one worker wins; a
+    stale lock is renamed away first. two workers racing to reclaim the same stale lock can
+    both end up reading the shard. read_shard notices when the other one has committed the
+    shard (or archived its frames from under it) and gives up on it, so the readings are never
+    duplicated and the loser carries on with the next shard.
+  '''
+  lock = shard_lock(jobdir, shard['id'])
+  owner = json.dumps({'host': socket.gethostname(), 'pid': os.getpid(), 'claimed': time.time()})
+  for attempt in range(2):
+    try:
+      fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      try:
+        age = time.time() - os.stat(lock).st_mtime
+        if attempt > 0 or age < lease:
+          return False
+        stale = '{}.stale.{}.{}'.format(lock, socket.gethostname(), os.getpid())
+        os.rename(lock, stale)
+        os.remove(stale)
+        printerr('reclaiming shard {} (lock untouched for {:.0f}s)'.format(shard['id'], age))
+      except FileNotFoundError:
+        # released or stolen by someone else between the open and the stat/rename
+        pass
+      continue
+    with os.fdopen(fd, 'w') as f:
+      f.write(owner)
+    return True
+  return False
+
+def release(jobdir, shard):
+  try:
+    os.remove(shard_lock(jobdir, shard['id']))
+  except FileNotFoundError:
+    pass
+
+def read_shard(jobdir, shard, profiles, options):
+  '''
+    read every frame of shard and commit its readings. a frame that cannot be read is skipped
+    and recorded in the shard's failures, so one bad image does not hold up the shard (or,
+    since every worker walks the manifest in the same order, the rest of the job). returns
+    False without committing anything when another worker finishes the shard first.
+  '''
+  import read_meter_images as reader
+  lock = shard_lock(jobdir, shard['id'])
+  output = shard_output(jobdir, shard['id'])
+  lines = []
+  failures = []
+  for filename in shard['frames']:
+    if os.path.exists(output):
+      debug('shard', shard['id'], 'was committed by another worker')
+      return False
+    frame_options = dict(options)
+    if profiles is not None:
+      frame_options['profile'] = meter_profiles.route(filename, profiles)
+      if frame_options['profile'] is None:
+        printerr('no meter profile matches {}; skipping'.format(filename))
+        continue
+    try:
+      with open(filename) as frame:
+        reading = reader.analyze_raw(frame, 'noop', frame_options)
+    except Exception as e:
+      # with --archive_dir the worker that committed the shard moves its frames away, possibly
+      # while this one is in the middle of reading one
+      if not os.path.exists(filename):
+        printerr('frame {} of shard {} is gone; leaving the shard to whoever moved it'.format(filename, shard['id']))
+        return False
+      printerr('could not read frame {} of shard {}: {}'.format(filename, shard['id'], e))
+      failures.append({'frame': filename, 'error': str(e)})
+      continue
+    lines.append(record_io.dumps(reading) + '\n')
+    # heartbeat, so other workers can tell this shard is still being worked on
+    try:
+      os.utime(lock)
+    except FileNotFoundError:
+      pass
+  if os.path.exists(output):
+    # the other worker committed the same readings and archives the frames itself
+    debug('shard', shard['id'], 'was committed by another worker')
+    return False
+  # failures are written before the output, so a committed shard always has its failures listed
+  failures_path = shard_failures(jobdir, shard['id'])
+  if failures:
+    os.makedirs(os.path.dirname(failures_path), exist_ok=True)
+    write_atomic(failures_path, json.dumps(failures, indent=2))
+  elif os.path.exists(failures_path):
+    os.remove(failures_path)
+  write_atomic(output, ''.join(lines))
+
+  # frames are only moved once their readings are committed; a crash in between leaves them in
+  # place, which is harmless because the shard is already done. frames that failed stay put
+  failed = set(f['frame'] for f in failures)
+  if options.get('archive_dir'):
+    for filename in shard['frames']:
+      if filename not in failed and os.path.exists(filename):
+        shutil.move(filename, options['archive_dir'])
+  return True
+
+def work(jobdir, options):
+  # the reader (cv2, numpy) is only imported by the action that reads frames
+  import read_meter_images as reader
+  reader.DEBUG = DEBUG
+
+  manifest = load_manifest(jobdir)
+  profiles = None
+  if manifest.get('profiles'):
+    profiles = meter_profiles.load_profiles(manifest['profiles'], reader.DEFAULT_PROFILE)
+
+  done = 0
+  for shard in manifest['shards']:
+    if os.path.exists(shard_output(jobdir, shard['id'])):
+      continue
+    if not claim(jobdir, shard, options.get('lease', DEFAULT_LEASE)):
+      continue
+    try:
+      # another worker may have finished it between our existence check and the claim
+      if not os.path.exists(shard_output(jobdir, shard['id'])):
+        debug('reading shard', shard['id'], len(shard['frames']), 'frames')
+        if read_shard(jobdir, shard, profiles, options):
+          done += 1
+    finally:
+      release(jobdir, shard)
+  return done
+
+def status(jobdir):
+  manifest = load_manifest(jobdir)
+  counts = {'done': 0, 'claimed': 0, 'pending': 0, 'failed_frames': 0}
+  for shard in manifest['shards']:
+    if os.path.exists(shard_output(jobdir, shard['id'])):
+      counts['done'] += 1
+      if os.path.exists(shard_failures(jobdir, shard['id'])):
+        with open(shard_failures(jobdir, shard['id'])) as f:
+          counts['failed_frames'] += len(json.load(f))
+    elif os.path.exists(shard_lock(jobdir, shard['id'])):
+      counts['claimed'] += 1
+    else:
+      counts['pending'] += 1
+  return counts
+
+def merge(jobdir, out, allow_partial=False):
+  '''
+    write committed shards to out in manifest order; the result only depends on the manifest
+    and shard contents, not on which worker read what or when
+  '''
+  manifest = load_manifest(jobdir)
+  missing = [shard['id'] for shard in manifest['shards'] if not os.path.exists(shard_output(jobdir, shard['id']))]
+  if missing and not allow_partial:
+    raise(Exception('{} shards are not done yet (first: {}); use --allow_partial to merge anyway'.format(len(missing), missing[0])))
+  for shard in manifest['shards']:
+    if shard['id'] in missing:
+      continue
+    # shards are already ndjson, so they are copied without decoding
+    with open(shard_output(jobdir, shard['id'])) as f:
+      shutil.copyfileobj(f, out)
+
+DEBUG = False
+
+def debug(*args, **kwargs):
+  if DEBUG:
+    printerr(*args, **kwargs)
+
+def printerr(*args, **kwargs):
+  print(*args, file=sys.stderr, **kwargs)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    prog = __file__,
+    description = 'Read meter images in day-sized shards shared between processes and hosts'
+  )
+  parser.add_argument('action', choices=['plan', 'work', 'merge', 'status'])
+  parser.add_argument('jobdir')
+  parser.add_argument('filename', nargs='*', help='frames to plan')
+  parser.add_argument('--profiles', help='meter profiles used to read the frames (plan)')
+  parser.add_argument('--archive_dir', help='move frames here once their shard is committed (work)')
+  parser.add_argument('--processes', type=int, default=1, help='worker processes on this host (work)')
+  parser.add_argument('--lease', type=float, default=DEFAULT_LEASE, help='seconds before an untouched lock is reclaimed (work)')
+  parser.add_argument('--output', help='merged readings file, default stdout (merge)')
+  parser.add_argument('--allow_partial', action='store_true', help='merge whatever shards are done (merge)')
+  parser.add_argument('-d', '--debug', action='store_true')   # on/off flag
+
+  args = parser.parse_args()
+
+  global DEBUG
+  if args.debug:
+    DEBUG = True
+
+  if args.action == 'plan':
+    if os.path.exists(manifest_path(args.jobdir)):
+      printerr('{} already has a manifest'.format(args.jobdir))
+      sys.exit(1)
+    for filename in args.filename:
+      if not os.path.exists(filename):
+        printerr('could not find file: {}'.format(filename))
+        printerr()
+        printerr(parser.format_help())
+        sys.exit(1)
+    manifest = plan(args.jobdir, args.filename, vars(args))
+    printerr('planned {} frames in {} shards'.format(len(args.filename), len(manifest['shards'])))
+  elif args.action == 'work':
+    if args.processes > 1:
+      with Pool(args.processes) as pool:
+        done = sum(pool.starmap(work, [(args.jobdir, vars(args))] * args.processes))
+    else:
+      done = work(args.jobdir, vars(args))
+    printerr('read {} shards; {}'.format(done, status(args.jobdir)))
+  elif args.action == 'merge':
+    if args.output:
+      # merge to a temporary file so readers of the output never see a half-written merge
+      tmp = '{}.{}.tmp'.format(args.output, os.getpid())
+      with open(tmp, 'w') as out:
+        merge(args.jobdir, out, args.allow_partial)
+      os.replace(tmp, args.output)
+    else:
+      try:
+        merge(args.jobdir, sys.stdout, args.allow_partial)
+      except BrokenPipeError as e:
+        pass
+  elif args.action == 'status':
+    print(json.dumps(status(args.jobdir)))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
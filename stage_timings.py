@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import record_io
+import time
+import math
+from collections import OrderedDict
+from contextlib import contextmanager
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+def percentile(sorted_values, q):
+  # nearest-rank percentile of an already sorted list
+  if not sorted_values:
+    return None
+  rank = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+  return sorted_values[rank]
+
+class StageTimings:
+  '''
+    records wall time per named stage and integer counts per frame.
+
+    with timings.stage('imread'):
+      ...
+    timings.count('contours', len(contours))
+    timings.end_frame(filename)
+
+    a disabled instance (the default in read_meter_images) makes every call a no-op.
+  '''
+  def __init__(self, enabled=True, ndjson_file=None):
+    self.enabled = enabled
+    self.ndjson_file = ndjson_file
+    self.stages = OrderedDict()
+    self.counts = OrderedDict()
+    self.frame_stages = OrderedDict()
+    self.frame_counts = OrderedDict()
+    self.frame_start = None
+    self.last_frame = None
+    self.frames = 0
+
+  @contextmanager
+  def stage(self, name):
+    if not self.enabled:
+      yield
+      return
+    start = time.perf_counter()
+    if self.frame_start is None:
+      self.frame_start = start
+    try:
+      yield
+    finally:
+      self.frame_stages[name] = self.frame_stages.get(name, 0) + time.perf_counter() - start
+
+  def count(self, name, n):
+    if self.enabled:
+      self.frame_counts[name] = self.frame_counts.get(name, 0) + n
+
+  def end_frame(self, imagesrc):
+    if not self.enabled:
+      return
+    total = 0 if self.frame_start is None else time.perf_counter() - self.frame_start
+    self.frame_stages['frame'] = total
+    self.last_frame = {
+      'imagesrc': imagesrc,
+      'stages': self.frame_stages,
+      'counts': self.frame_counts,
+    }
+    self.record(self.last_frame)
+    self.frame_stages = OrderedDict()
+    self.frame_counts = OrderedDict()
+    self.frame_start = None
+
+  def record(self, frame):
+    '''
+      add one frame's stages and counts, e.g. a last_frame sent back from a worker process
+    '''
+    for name, seconds in frame['stages'].items():
+      self.stages.setdefault(name, []).append(seconds)
+    for name, n in frame['counts'].items():
+      self.counts.setdefault(name, []).append(n)
+    if self.ndjson_file is not None:
+      self.ndjson_file.write(record_io.dumps(frame) + '\n')
+      self.ndjson_file.flush()
+    self.frames += 1
+
+  def summary(self):
+    '''
+      {stage: {'count', 'total', 'mean', 'p50', 'p90', 'p99', 'max'}} for stages and counts
+    '''
+    def describe(values):
+      values = sorted(values)
+      d = OrderedDict([('count', len(values)), ('total', sum(values)), ('mean', sum(values) / len(values))])
+      for q in QUANTILES:
+        d['p{}'.format(int(q * 100))] = percentile(values, q)
+      d['max'] = values[-1]
+      return d
+    return {
+      'stages': OrderedDict((name, describe(v)) for name, v in self.stages.items()),
+      'counts': OrderedDict((name, describe(v)) for name, v in self.counts.items()),
+    }
+
+  def print_summary(self, file=sys.stderr):
+    if not self.enabled or not self.frames:
+      return
+    summary = self.summary()
+    print('{} frames'.format(self.frames), file=file)
+    print('{:<20} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('stage (ms)', 'mean', 'p50', 'p90', 'p99', 'max'), file=file)
+    for name, d in summary['stages'].items():
+      print('{:<20} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+        name, *[d[k] * 1000 for k in ['mean', 'p50', 'p90', 'p99', 'max']]), file=file)
+    for name, d in summary['counts'].items():
+      print('{:<20} {:>10.1f} {:>10} {:>10} {:>10} {:>10}'.format(
+        name, d['mean'], d['p50'], d['p90'], d['p99'], d['max']), file=file)
+
+  def write_prometheus(self, path, prefix='metermaid'):
+    '''
+      write the summary in the node_exporter textfile-collector format. the file is written
+      under a temporary name and renamed so the collector never reads a partial file.
+    '''
+    if not self.enabled:
+      return
+    summary = self.summary()
+    lines = [
+      '# HELP {}_stage_seconds wall time per frame of each meter reading stage'.format(prefix),
+      '# TYPE {}_stage_seconds summary'.format(prefix),
+    ]
+    for name, d in summary['stages'].items():
+      for q in QUANTILES:
+        lines.append('{}_stage_seconds{{stage="{}",quantile="{}"}} {}'.format(prefix, name, q, d['p{}'.format(int(q * 100))]))
+      lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(prefix, name, d['total']))
+      lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, name, d['count']))
+    lines += [
+      '# HELP {}_frame_items items found per frame (contours, dials)'.format(prefix),
+      '# TYPE {}_frame_items summary'.format(prefix),
+    ]
+    for name, d in summary['counts'].items():
+      for q in QUANTILES:
+        lines.append('{}_frame_items{{item="{}",quantile="{}"}} {}'.format(prefix, name, q, d['p{}'.format(int(q * 100))]))
+      lines.append('{}_frame_items_sum{{item="{}"}} {}'.format(prefix, name, d['total']))
+      lines.append('{}_frame_items_count{{item="{}"}} {}'.format(prefix, name, d['count']))
+    lines += [
+      '# HELP {}_last_run_timestamp_seconds when these timings were written'.format(prefix),
+      '# TYPE {}_last_run_timestamp_seconds gauge'.format(prefix),
+      '{}_last_run_timestamp_seconds {}'.format(prefix, time.time()),
+    ]
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+NO_TIMINGS = StageTimings(enabled=False)
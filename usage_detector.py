@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+'''
+  online detection over the rates process_series.py emits. everything is kept in a handful of
+  running values, so memory does not grow with the length of the series.
+
+  - baseline: a time-weighted moving average of the rate outside of burns (pilot lights and
+    other background usage)
+  - burns: contiguous runs of rates well above the baseline, summarized when they end and
+    labelled with the appliance (or combination) whose rated draw is closest. appliances whose
+    draws are too close to tell apart are told apart by how long they usually burn
+  - continuous flow: gas has not stopped flowing for longer than leak_window seconds
+
+  overlapping burns cannot be seen at the current frame rate: process_series.py reads the 2 cf
+  test dial, and a frame-to-frame move of more than MAX_JITTER of a revolution (1 cf in 10s,
+  0.1 cf/s or ~370kBTU/hr) is taken as jitter and dropped. two 200kBTU/hr appliances together
+  draw ~0.107 cf/s, so the pair labels below only come up with faster frames or smaller
+  appliances.
+
+  appliance ratings can be given in a json file (process_series.py --appliances):
+
+  {
+    "appliances": {
+      "furnace": { "btu_per_hour": 100000, "duration": 600 },
+      "water heater": { "btu_per_hour": 40000, "duration": 1800 }
+    }
+  }
+
+  duration is the typical length of a burn in seconds and may be left out.
+'''
+
+import json
+from math import exp, log
+
+# natural gas, BTU per cubic foot
+BTU_PER_CF = 1037
+
+# both are rated at 200kBTU/hr (see DIALS in read_meter_images.py), so only the typical burn
+# length (a rough guess: furnace cycles are shorter than a water heater's recovery after a
+# shower) tells them apart. use --appliances for the real ratings
+APPLIANCES = {
+  'furnace': {'btu_per_hour': 200000, 'duration': 10 * 60},
+  'water heater': {'btu_per_hour': 200000, 'duration': 30 * 60},
+}
+
+DEFAULTS = {
+  # seconds over which the baseline forgets old samples
+  'baseline_window': 6 * 3600,
+  # a rate this far (cf/s) above the baseline is a burn. 0.01 cf/s is ~37kBTU/hr
+  'burn_threshold': 0.01,
+  # a burn ends when the next rate above the threshold starts more than this many seconds (in
+  # frame time) after it. rates are only emitted when the test dial moves, so a gap means the
+  # flow dropped off
+  'burn_gap': 60,
+  # follow mode only: a burn still open after the readings file has not grown for this many
+  # seconds of wall-clock time is summarized, on the assumption that capture has stalled. it
+  # is well over how long read_meter_images.sh batches leave the file alone, so batching
+  # never splits a burn
+  'stall_timeout': 30 * 60,
+  # any rate above this (cf/s) counts as flow for the continuous flow check
+  'flow_threshold': 0.0002,
+  # flow for this long without a break is flagged. a rate spread over more than flow_gap seconds
+  # (the dial sat still that long) counts as a break
+  'leak_window': 2 * 3600,
+  'flow_gap': 15 * 60,
+  # appliance labels are a tie when their rated draws are within this fraction of each other;
+  # durations are a tie within this much of log(burn duration / typical duration)
+  'label_tolerance': 0.1,
+}
+
+def load_appliances(path):
+  with open(path) as f:
+    config = json.load(f)
+  appliances = config.get('appliances', {})
+  for name, appliance in appliances.items():
+    if 'btu_per_hour' not in appliance:
+      raise(Exception('appliance {} in {} is missing btu_per_hour'.format(name, path)))
+  if not appliances:
+    raise(Exception('no appliances found in ' + path))
+  return appliances
+
+def appliance_candidates(appliances):
+  '''
+    (name, rate in cf/s, typical burn seconds or None) for each appliance alone plus every
+    pair running together. a pair burns about as long as the shorter of the two.
+  '''
+  names = sorted(appliances)
+  rates = dict((name, appliances[name]['btu_per_hour'] / BTU_PER_CF / 3600) for name in names)
+  durations = dict((name, appliances[name].get('duration')) for name in names)
+  candidates = [(name, rates[name], durations[name]) for name in names]
+  for i, a in enumerate(names):
+    for b in names[i + 1:]:
+      duration = None if durations[a] is None or durations[b] is None else min(durations[a], durations[b])
+      candidates.append(('{}+{}'.format(a, b), rates[a] + rates[b], duration))
+  return candidates
+
+def label(rate, duration, candidates, tolerance):
+  '''
+    the candidate whose rate is closest. candidates within tolerance of that are a tie, which
+    is broken by how close the burn's duration is to their typical one; a tie that durations
+    cannot break is reported as 'a or b'
+  '''
+  best = min(abs(rate - r) for _, r, _ in candidates)
+  closest = [(name, typical) for name, r, typical in candidates if abs(rate - r) <= best + tolerance * r]
+  if len(closest) > 1 and duration > 0 and all(typical for _, typical in closest):
+    # compare durations as ratios, so 5 vs 10 minutes is as far apart as 30 vs 60
+    distance = dict((name, abs(log(duration / typical))) for name, typical in closest)
+    nearest = min(distance.values())
+    closest = [(name, typical) for name, typical in closest if distance[name] <= nearest + tolerance]
+  return ' or '.join(name for name, _ in closest)
+
+class UsageDetector:
+  def __init__(self, options={}, appliances=APPLIANCES, emit=print):
+    self.options = dict(DEFAULTS)
+    self.options.update(dict((k, v) for k, v in options.items() if k in DEFAULTS and v is not None))
+    self.candidates = appliance_candidates(appliances)
+    self.emit = emit
+
+    # start from no background usage; the baseline rises to meet it over baseline_window
+    self.baseline = 0
+
+    # current burn, if any
+    self.burn = None
+
+    # continuous flow tracking
+    self.flow_since = None
+    self.leak_flagged = False
+
+  def add(self, diff):
+    '''
+      feed one rate record from process_series.get_diff
+    '''
+    timestamp = diff['timestamp']
+    rate = diff['rate']
+    interval_start = timestamp - diff['delta_time']
+
+    if self.burn is not None and interval_start - self.burn['end'] > self.options['burn_gap']:
+      self.end_burn()
+
+    if rate > self.baseline + self.options['burn_threshold']:
+      self.add_to_burn(diff)
+    else:
+      if self.burn is not None:
+        self.end_burn()
+      self.update_baseline(rate, diff['delta_time'])
+
+    self.update_flow(rate, diff['delta_time'], timestamp, interval_start)
+
+  def tick(self, idle):
+    '''
+      follow mode calls this while it waits for the readings file to grow, with the wall-clock
+      seconds it has waited. burns are otherwise only ended by the rates themselves (so follow
+      and batch runs segment a file the same way); this only closes a burn once capture looks
+      stalled.
+    '''
+    if self.burn is not None and idle > self.options['stall_timeout']:
+      self.end_burn()
+
+  def finish(self):
+    '''
+      summarize a burn still in progress when the input ends
+    '''
+    if self.burn is not None:
+      self.end_burn()
+
+  def update_baseline(self, rate, delta_time):
+    # weight by how much time the sample covers, so a rate averaged over a long idle gap counts
+    # for as much as the many short samples it replaces. background usage is the floor of the
+    # series, so the baseline falls a lot faster than it rises
+    window = self.options['baseline_window'] / (1 if rate > self.baseline else 12)
+    alpha = 1 - exp(-delta_time / window)
+    self.baseline += alpha * (rate - self.baseline)
+
+  def add_to_burn(self, diff):
+    if self.burn is None:
+      self.burn = {
+        'start': diff['timestamp'] - diff['delta_time'],
+        'cf': 0,
+        'peak_rate': 0,
+        'samples': 0,
+        'baseline': self.baseline,
+      }
+    self.burn['end'] = diff['timestamp']
+    self.burn['cf'] += diff['delta']
+    self.burn['peak_rate'] = max(self.burn['peak_rate'], diff['rate'])
+    self.burn['samples'] += 1
+
+  def end_burn(self):
+    burn = self.burn
+    self.burn = None
+    duration = burn['end'] - burn['start']
+    mean_rate = burn['cf'] / duration if duration else burn['peak_rate']
+    self.emit({
+      'type': 'burn',
+      'start': burn['start'],
+      'end': burn['end'],
+      'duration': duration,
+      'cf': burn['cf'],
+      'mean_rate': mean_rate,
+      'peak_rate': burn['peak_rate'],
+      'samples': burn['samples'],
+      'baseline': burn['baseline'],
+      'appliance': label(mean_rate - burn['baseline'], duration, self.candidates, self.options['label_tolerance']),
+    })
+
+  def update_flow(self, rate, delta_time, timestamp, interval_start):
+    if rate <= self.options['flow_threshold'] or delta_time > self.options['flow_gap']:
+      self.flow_since = None
+      self.leak_flagged = False
+      return
+    if self.flow_since is None:
+      self.flow_since = interval_start
+    duration = timestamp - self.flow_since
+    if duration > self.options['leak_window'] and not self.leak_flagged:
+      self.leak_flagged = True
+      self.emit({
+        'type': 'continuous_flow',
+        'since': self.flow_since,
+        'timestamp': timestamp,
+        'duration': duration,
+        'rate': rate,
+        'baseline': self.baseline,
+      })